@@ -1,15 +1,38 @@
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, request, jsonify, session
 import re
 import logging
 import os
-import openai
-from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import unicodedata
 import json
+import glob
+import marshal
+import mmap
+import pickle
+import signal
+import struct
+import atexit
+import sys
+import threading
+import time
+import tracemalloc
+import gzip
+import hashlib
+import hmac
+import math
+from functools import wraps
 from collections import OrderedDict
 
-load_dotenv()
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se usa gzip
+    brotli = None
+
+# dotenv solo se importa si hay un .env (en producción las variables vienen del entorno)
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+if any(os.path.exists(os.path.join(directory, '.env')) for directory in (APP_DIR, os.getcwd())):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'default-secret-key-123')
@@ -18,13 +41,210 @@ app.permanent_session_lifetime = timedelta(hours=1)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configurar OpenAI
-openai.api_key = os.getenv('OPENAI_API_KEY')
+# Configurar OpenAI. El módulo se importa en el primer uso: es la dependencia más pesada
+# y muchas respuestas (saludos, roles, presupuesto agotado) no la necesitan.
+# OPENAI_API_BASE permite apuntar a un servidor compatible (p.ej. mock_llm.py)
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '30'))
+
+_openai = None
+
+def get_openai():
+    """Importa y configura el cliente de OpenAI la primera vez que se necesita"""
+    global _openai
+    if _openai is None:
+        import openai
+        openai.api_key = os.getenv('OPENAI_API_KEY')
+        if OPENAI_API_BASE:
+            openai.api_base = OPENAI_API_BASE
+        _openai = openai
+    return _openai
+
+# Estructuras precalculadas (keywords, índice difuso, estáticos comprimidos) serializadas
+# para no reconstruirlas en cada arranque; vacío = deshabilitado
+STARTUP_ARTIFACT_PATH = os.getenv('STARTUP_ARTIFACT_PATH', os.path.join(APP_DIR, 'startup.artifact'))
+STARTUP_ARTIFACT_VERSION = 2
+
+# Token para los endpoints de administración (vacío = deshabilitados)
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+# Límites del profiler por muestreo
+PROFILER_MAX_SECONDS = int(os.getenv('PROFILER_MAX_SECONDS', '60'))
+PROFILER_MAX_DEPTH = 64
+
+# Presupuesto de memoria para el caché de sesiones
+SESSION_MEMORY_BUDGET = int(float(os.getenv('SESSION_MEMORY_BUDGET_MB', '64')) * 1024 * 1024)
+
+# Frames a registrar con tracemalloc (0 = deshabilitado, tiene costo en CPU y memoria)
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', '0'))
+if TRACEMALLOC_FRAMES > 0:
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+
+# Prefetch especulativo de la respuesta al siguiente tema probable
+PREFETCH_MAX_CONCURRENT = int(os.getenv('PREFETCH_MAX_CONCURRENT', '2'))  # 0 = deshabilitado
+PREFETCH_MIN_PROBABILITY = float(os.getenv('PREFETCH_MIN_PROBABILITY', '0.3'))
+PREFETCH_MIN_TRANSITIONS = int(os.getenv('PREFETCH_MIN_TRANSITIONS', '3'))
+PREFETCH_TTL = int(os.getenv('PREFETCH_TTL', '600'))
+
+# Presupuestos de tokens de OpenAI para toda la app (0 = sin límite); al agotarse se responde solo
+# con la base de conocimiento. Cada worker lleva su propia cuenta, así que usa su parte del total
+WEB_CONCURRENCY = max(1, int(os.getenv('WEB_CONCURRENCY', '1')))
+
+def per_worker_budget(total):
+    return max(1, total // WEB_CONCURRENCY) if total > 0 else 0
+
+TOKEN_BUDGET_HOURLY = per_worker_budget(int(os.getenv('TOKEN_BUDGET_HOURLY', '0')))
+TOKEN_BUDGET_DAILY = per_worker_budget(int(os.getenv('TOKEN_BUDGET_DAILY', '0')))
+TOKEN_USAGE_HOURS_KEPT = 48
+
+# Compresión de respuestas
+STATIC_DIR = APP_DIR
+STATIC_FILES = ['frontend.html', 'index.html']
+STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', '300'))
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/plain', 'text/css', 'application/javascript', 'application/json'}
+
+# Snapshot de sesiones para reinicios en caliente (vacío = deshabilitado)
+# Cada worker guarda su propio archivo `<ruta>.<pid>`; al arrancar cada archivo lo restaura un solo worker
+SESSION_SNAPSHOT_PATH = os.getenv('SESSION_SNAPSHOT_PATH', os.path.join(APP_DIR, 'sessions.snapshot'))
+
+# Formato del snapshot: cabecera + registros con largo prefijado.
+# Cada registro de sesión lleva (largo id, last_activity, largo payload) para
+# poder indexarlo sin deserializar el payload.
+SNAPSHOT_MAGIC = b'CSNP1'
+SNAPSHOT_RECORD = struct.Struct('>HdI')
+SNAPSHOT_METRICS = struct.Struct('>I')
+
+def _build_accent_table():
+    """Tabla de traducción que elimina tildes y diacríticos (á -> a, ñ -> n)"""
+    table = {}
+    for code in range(0xC0, 0x250):
+        char = chr(code)
+        stripped = ''.join(c for c in unicodedata.normalize('NFD', char)
+                           if unicodedata.category(c) != 'Mn')
+        if stripped and stripped != char:
+            table[code] = stripped
+    return str.maketrans(table)
+
+ACCENT_TABLE = _build_accent_table()
+TOKEN_PATTERN = re.compile(r'\w+')
+BASE_PATTERN = re.compile(r'(?:base|ciudad|aeropuerto)\s+(?:de\s+)?([a-zA-Z\s]+)')
+
+# Patrones normalizados -> forma que se muestra en el prompt
+TIME_PATTERNS = {'manana': 'mañana', 'tarde': 'tarde', 'noche': 'noche', 'dia': 'día', 'mes': 'mes', 'semana': 'semana'}
+FAREWELLS = ['adios', 'chao', 'hasta luego', 'nos vemos', 'bye', 'gracias', 'muchas gracias', 'thank you', 'thanks']
+GREETINGS = ['hola', 'buenos dias', 'buenas tardes', 'buenas noches', 'hi', 'hello']
+ROLE_DECLARATIONS = {'soy tripulante': 'tripulante', 'soy piloto': 'piloto', 'soy capitan': 'capitan'}
+# Palabras que no cambian el sentido de una pregunta sobre un tema ("¿cómo funcionan las vacaciones?")
+PLAIN_QUESTION_WORDS = {'que', 'como', 'cual', 'cuales', 'cuanto', 'cuanta', 'cuantos', 'cuantas', 'cuando', 'donde',
+                        'hay', 'es', 'son', 'funciona', 'funcionan', 'cuentame', 'info', 'informacion', 'sobre',
+                        'acerca', 'tema', 'el', 'la', 'los', 'las', 'lo', 'un', 'una', 'de', 'del', 'a', 'al', 'en',
+                        'por', 'para', 'y', 'o', 'mi', 'mis', 'me', 'favor'}
+
+# Tolerancia a errores de tipeo: largo mínimo de palabra por distancia de edición permitida
+FUZZY_MIN_LENGTH = {1: 5, 2: 9}
+FUZZY_MATCH_WEIGHT = 0.5  # una coincidencia aproximada vale menos que una exacta
+
+def normalize(text):
+    """Minúsculas y sin tildes, usando la tabla precalculada"""
+    return text.lower().translate(ACCENT_TABLE)
+
+def max_edit_distance(word):
+    distance = 0
+    for allowed, min_length in FUZZY_MIN_LENGTH.items():
+        if len(word) >= min_length:
+            distance = allowed
+    return distance
+
+def deletions(word, distance):
+    """Todas las variantes de `word` con hasta `distance` caracteres eliminados"""
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+def edit_distance(a, b):
+    """Distancia de Damerau-Levenshtein restringida (incluye transposiciones)"""
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[len(b)]
+
+class FuzzyKeywordIndex:
+    """Índice de eliminaciones (estilo SymSpell) sobre las keywords de una palabra.
+
+    Se construye una vez al iniciar; cada búsqueda solo genera las eliminaciones del
+    token consultado y las verifica contra los candidatos del índice.
+    """
+    def __init__(self, topic_keywords):
+        self.keyword_topics = {}
+        for topic, keywords in topic_keywords.items():
+            for keyword in keywords:
+                if ' ' not in keyword and max_edit_distance(keyword) > 0:
+                    self.keyword_topics.setdefault(keyword, set()).add(topic)
+
+        self.index = {}
+        for keyword in self.keyword_topics:
+            for variant in deletions(keyword, max_edit_distance(keyword)):
+                self.index.setdefault(variant, set()).add(keyword)
+
+    def state(self):
+        return {'keyword_topics': self.keyword_topics, 'index': self.index}
+
+    @classmethod
+    def from_state(cls, state):
+        """Reconstruye el índice desde datos serializados, sin recalcular eliminaciones"""
+        fuzzy_index = cls.__new__(cls)
+        fuzzy_index.keyword_topics = state['keyword_topics']
+        fuzzy_index.index = state['index']
+        return fuzzy_index
+
+    def lookup(self, token):
+        """Keywords a distancia 1..max del token (las exactas se excluyen)"""
+        distance = max_edit_distance(token)
+        if distance == 0 or token in self.keyword_topics:
+            return set()
+        candidates = set()
+        for variant in deletions(token, distance):
+            candidates |= self.index.get(variant, set())
+        return {keyword for keyword in candidates
+                if edit_distance(token, keyword) <= min(distance, max_edit_distance(keyword))}
+
+class AnalyzedMessage:
+    """Mensaje preprocesado una sola vez y compartido por todas las etapas"""
+    __slots__ = ('text', 'normalized', 'tokens', 'entities', 'topic_scores')
+
+    def __init__(self, text, normalized, tokens, entities, topic_scores):
+        self.text = text
+        self.normalized = normalized
+        self.tokens = tokens
+        self.entities = entities
+        self.topic_scores = topic_scores
+
+    @property
+    def topics(self):
+        """Temas con al menos una coincidencia, en el orden de la base de conocimiento"""
+        return [topic for topic, score in self.topic_scores.items() if score > 0]
 
 class LRUCache:
-    def __init__(self, capacity):
+    """LRU acotado por cantidad de entradas y, opcionalmente, por bytes aproximados"""
+    def __init__(self, capacity, max_bytes=None):
         self.cache = OrderedDict()
         self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.sizes = {}
+        self.total_bytes = 0
+        self.evictions = 0
 
     def get(self, key):
         if key not in self.cache:
@@ -32,16 +252,213 @@ class LRUCache:
         self.cache.move_to_end(key)
         return self.cache[key]
 
-    def put(self, key, value):
+    def put(self, key, value, size=0):
         if key in self.cache:
             self.cache.move_to_end(key)
         self.cache[key] = value
-        if len(self.cache) > self.capacity:
-            self.cache.popitem(last=False)
+        self._set_size(key, size)
+        self._evict()
+
+    def resize(self, key, size):
+        """Actualiza el tamaño de una entrada que creció después de insertarla"""
+        if key not in self.cache:
+            return
+        self._set_size(key, size)
+        self._evict()
+
+    def remove(self, key):
+        self.cache.pop(key, None)
+        self.total_bytes -= self.sizes.pop(key, 0)
+
+    def _set_size(self, key, size):
+        self.total_bytes += size - self.sizes.get(key, 0)
+        self.sizes[key] = size
+
+    def _evict(self):
+        # Nunca se expulsa la entrada más reciente, aunque por sí sola exceda el presupuesto
+        while len(self.cache) > 1 and (len(self.cache) > self.capacity or
+                                       (self.max_bytes and self.total_bytes > self.max_bytes)):
+            key, _ = self.cache.popitem(last=False)
+            self.total_bytes -= self.sizes.pop(key, 0)
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.cache
+
+class SamplingProfiler:
+    """Profiler por muestreo: un hilo aparte lee las pilas de los demás hilos
+    cada `interval` segundos y las acumula en formato colapsado (flamegraph)"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stacks = {}
+        self.samples = 0
+        self.started_at = None
+        self.duration = 0
+        self.interval = 0
+        self.topic_tags = {}
+
+    @property
+    def active(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration, interval=0.005):
+        with self.lock:
+            if self.active:
+                return False
+            self.stacks = {}
+            self.samples = 0
+            self.started_at = datetime.now()
+            self.duration = min(duration, PROFILER_MAX_SECONDS)
+            self.interval = max(interval, 0.001)
+            self.thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self.thread.start()
+            return True
+
+    def wait(self):
+        """Bloquea hasta que termina el perfilado en curso"""
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    def tag(self, topic):
+        """Etiqueta las muestras del hilo actual con el tema elegido"""
+        if self.active:
+            self.topic_tags[threading.get_ident()] = topic
+
+    def clear_tag(self):
+        self.topic_tags.pop(threading.get_ident(), None)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.duration
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = self._collapse(frame)
+                topic = self.topic_tags.get(thread_id)
+                if topic:
+                    stack = f"topic:{topic};{stack}"
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                self.samples += 1
+            time.sleep(self.interval)
+        self.topic_tags.clear()
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < PROFILER_MAX_DEPTH:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def collapsed(self):
+        """Pilas en formato `frame;frame;frame cantidad`, una por línea"""
+        stacks = sorted(dict(self.stacks).items(), key=lambda x: x[1], reverse=True)
+        return '\n'.join(f"{stack} {count}" for stack, count in stacks)
+
+    def status(self):
+        return {
+            'active': self.active,
+            'pid': os.getpid(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'duration': self.duration,
+            'interval': self.interval,
+            'samples': self.samples,
+            'unique_stacks': len(self.stacks)
+        }
+
+profiler = SamplingProfiler()
+
+def compress(body, encoding, static=False):
+    """Comprime con gzip o brotli; los estáticos usan el nivel máximo porque se hace una sola vez"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=11 if static else 4)
+    return gzip.compress(body, compresslevel=9 if static else 6)
+
+def choose_encoding(accept_encodings):
+    """Elige la mejor codificación soportada por el cliente"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+class StaticAsset:
+    """Archivo estático cargado y precomprimido al iniciar"""
+    def __init__(self, body, mimetype, encoded=None):
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()[:16]
+        if encoded is None:
+            encoded = {None: body, 'gzip': compress(body, 'gzip', static=True)}
+            if brotli is not None:
+                encoded['br'] = compress(body, 'br', static=True)
+        self.encoded = encoded
+
+    def state(self):
+        return {'mimetype': self.mimetype, 'etag': self.etag, 'encoded': self.encoded}
+
+def load_static_assets(directory=STATIC_DIR, filenames=STATIC_FILES, cached=None):
+    """Carga los estáticos, reutilizando las versiones comprimidas en `cached` si no cambiaron"""
+    cached = cached or {}
+    assets = {}
+    for filename in filenames:
+        try:
+            with open(os.path.join(directory, filename), 'rb') as f:
+                body = f.read()
+        except OSError as e:
+            logger.error(f"No se pudo cargar {filename}: {e}")
+            continue
+        previous = cached.get(filename)
+        if (previous is not None and previous['encoded'][None] == body and
+                ('br' in previous['encoded']) == (brotli is not None)):
+            assets[filename] = StaticAsset(body, previous['mimetype'], previous['encoded'])
+        else:
+            assets[filename] = StaticAsset(body, 'text/html')
+    return assets
+
+def load_startup_artifact(path=STARTUP_ARTIFACT_PATH):
+    """Lee el artefacto con marshal: solo contiene datos (dicts, listas, sets, bytes) y,
+    a diferencia de pickle, leerlo no ejecuta código aunque el archivo haya sido alterado"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'rb') as f:
+            artifact = marshal.load(f)
+    except Exception as e:
+        logger.warning(f"Artefacto de arranque inválido ({path}): {e}")
+        return {}
+    if not isinstance(artifact, dict) or artifact.get('version') != STARTUP_ARTIFACT_VERSION:
+        return {}
+    return artifact
+
+def save_startup_artifact(artifact, path=STARTUP_ARTIFACT_PATH):
+    """Guarda el artefacto de arranque (mejor esfuerzo: el sistema de archivos puede ser de solo lectura)"""
+    if not path:
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(artifact, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"No se pudo guardar el artefacto de arranque ({path}): {e}")
+
+def estimate_session_size(session_data):
+    """Tamaño aproximado en bytes de una sesión (contenedores + textos del historial)"""
+    size = sys.getsizeof(session_data) + sys.getsizeof(session_data['messages'])
+    for msg in session_data['messages']:
+        size += sys.getsizeof(msg) + sys.getsizeof(msg['text']) + sys.getsizeof(msg['timestamp'])
+        if 'topics' in msg:
+            size += sys.getsizeof(msg['topics']) + sys.getsizeof(msg['entities'])
+    if 'prefetched' in session_data:
+        size += sys.getsizeof(session_data['prefetched']['response'])
+    return size
 
 class SessionManager:
-    def __init__(self, max_sessions=1000, session_timeout=3600):
-        self.sessions = LRUCache(max_sessions)
+    def __init__(self, max_sessions=1000, session_timeout=3600, max_bytes=SESSION_MEMORY_BUDGET):
+        self.sessions = LRUCache(max_sessions, max_bytes=max_bytes)
         self.session_timeout = session_timeout
         self.last_cleanup = datetime.now()
         self.cleanup_interval = 300  # 5 minutos
@@ -51,8 +468,21 @@ class SessionManager:
             'roles_frequency': {},
             'active_sessions': 0,
             'avg_messages_per_session': 0,
-            'response_times': []
+            'response_times': [],
+            # Modelo de transiciones entre temas: tema anterior -> {tema siguiente: cantidad}
+            'topic_transitions': {},
+            'prefetch': {'started': 0, 'skipped': 0, 'hits': 0, 'misses': 0},
+            # Tokens de OpenAI por tema, rol y hora ('%Y-%m-%dT%H')
+            'token_usage': {'by_topic': {}, 'by_role': {}, 'by_hour': {}, 'degraded_responses': 0}
         }
+        # Los hilos de prefetch registran tokens en paralelo a las peticiones
+        self.token_lock = threading.Lock()
+        # Sesiones restauradas desde snapshot que aún no se han cargado:
+        # session_id -> (mmap, offset, largo, last_activity)
+        self.restored_index = {}
+        # Archivos de snapshot mapeados en memoria: mmap -> [archivo, sesiones pendientes].
+        # Se cierran cuando ya no queda ninguna entrada de restored_index que apunte a ellos
+        self._snapshot_maps = {}
 
     def update_metrics(self, session_data, topic=None, response_time=None):
         self.metrics['total_interactions'] += 1
@@ -75,8 +505,69 @@ class SessionManager:
         if self.metrics['active_sessions'] > 0:
             self.metrics['avg_messages_per_session'] = total_messages / self.metrics['active_sessions']
 
+    def record_topic_transition(self, previous_topic, topic):
+        transitions = self.metrics['topic_transitions'].setdefault(previous_topic, {})
+        transitions[topic] = transitions.get(topic, 0) + 1
+
+    def predict_next_topic(self, topic, min_probability=PREFETCH_MIN_PROBABILITY, min_count=PREFETCH_MIN_TRANSITIONS):
+        """Tema siguiente más probable según las sesiones anteriores, o None"""
+        transitions = self.metrics['topic_transitions'].get(topic)
+        if not transitions:
+            return None
+        next_topic, count = max(transitions.items(), key=lambda x: x[1])
+        if count < min_count or count / sum(transitions.values()) < min_probability:
+            return None
+        return next_topic
+
+    def record_token_usage(self, topic, role, prompt_tokens, completion_tokens):
+        usage = self.metrics['token_usage']
+        hour = datetime.now().strftime('%Y-%m-%dT%H')
+        with self.token_lock:
+            for bucket, key in ((usage['by_topic'], topic or 'general'), (usage['by_role'], role or 'sin_rol'),
+                                (usage['by_hour'], hour)):
+                counts = bucket.setdefault(key, {'prompt': 0, 'completion': 0, 'calls': 0})
+                counts['prompt'] += prompt_tokens
+                counts['completion'] += completion_tokens
+                counts['calls'] += 1
+            # Conservar solo las últimas horas
+            if len(usage['by_hour']) > TOKEN_USAGE_HOURS_KEPT:
+                for old_hour in sorted(usage['by_hour'])[:-TOKEN_USAGE_HOURS_KEPT]:
+                    del usage['by_hour'][old_hour]
+
+    def tokens_used(self, period='hour'):
+        """Tokens consumidos en la hora o el día en curso por este worker"""
+        with self.token_lock:
+            return self._tokens_used(period)
+
+    def _tokens_used(self, period):
+        prefix = datetime.now().strftime('%Y-%m-%dT%H' if period == 'hour' else '%Y-%m-%d')
+        return sum(counts['prompt'] + counts['completion']
+                   for hour, counts in self.metrics['token_usage']['by_hour'].items() if hour.startswith(prefix))
+
+    def token_budget_exhausted(self):
+        return ((TOKEN_BUDGET_HOURLY > 0 and self.tokens_used('hour') >= TOKEN_BUDGET_HOURLY) or
+                (TOKEN_BUDGET_DAILY > 0 and self.tokens_used('day') >= TOKEN_BUDGET_DAILY))
+
     def get_metrics(self):
         avg_response_time = sum(self.metrics['response_times']) / len(self.metrics['response_times']) if self.metrics['response_times'] else 0
+        prefetch = self.metrics['prefetch']
+        lookups = prefetch['hits'] + prefetch['misses']
+        budget_exhausted = self.token_budget_exhausted()
+        usage = self.metrics['token_usage']
+        with self.token_lock:
+            token_usage = {
+                'by_topic': dict(sorted(usage['by_topic'].items(),
+                                        key=lambda x: x[1]['prompt'] + x[1]['completion'], reverse=True)),
+                'by_role': dict(usage['by_role']),
+                'by_hour': dict(sorted(usage['by_hour'].items())),
+                'current_hour': self._tokens_used('hour'),
+                'today': self._tokens_used('day'),
+                'hourly_budget': TOKEN_BUDGET_HOURLY,
+                'daily_budget': TOKEN_BUDGET_DAILY,
+                'workers': WEB_CONCURRENCY,
+                'budget_exhausted': budget_exhausted,
+                'degraded_responses': usage['degraded_responses']
+            }
         
         return {
             'total_interactions': self.metrics['total_interactions'],
@@ -84,7 +575,9 @@ class SessionManager:
             'roles_frequency': self.metrics['roles_frequency'],
             'active_sessions': self.metrics['active_sessions'],
             'avg_messages_per_session': round(self.metrics['avg_messages_per_session'], 2),
-            'avg_response_time': round(avg_response_time, 2)
+            'avg_response_time': round(avg_response_time, 2),
+            'prefetch': dict(prefetch, hit_rate=round(prefetch['hits'] / lookups, 4) if lookups else 0),
+            'token_usage': token_usage
         }
 
     def get_session(self, session_id):
@@ -92,14 +585,17 @@ class SessionManager:
             self._cleanup_old_sessions()
         
         session_data = self.sessions.get(session_id)
+        if session_data is None and session_id in self.restored_index:
+            session_data = self._load_restored_session(session_id)
         if session_data is None:
             session_data = {
                 'role': None,
                 'messages': [],
+                'turns': 0,
                 'last_topic': None,
                 'last_activity': datetime.now()
             }
-            self.sessions.put(session_id, session_data)
+            self.sessions.put(session_id, session_data, estimate_session_size(session_data))
         else:
             session_data['last_activity'] = datetime.now()
         return session_data
@@ -111,18 +607,186 @@ class SessionManager:
         current_time = datetime.now()
         self.last_cleanup = current_time
         
-        # Crear una nueva lista de sesiones válidas
-        valid_sessions = OrderedDict()
-        for session_id, data in self.sessions.cache.items():
-            if (current_time - data['last_activity']).seconds < self.session_timeout:
-                valid_sessions[session_id] = data
-        
-        self.sessions.cache = valid_sessions
+        # Eliminar las sesiones inactivas (y su tamaño contabilizado)
+        expired_sessions = [session_id for session_id, data in self.sessions.cache.items()
+                            if self._is_expired(data['last_activity'], current_time)]
+        for session_id in expired_sessions:
+            self.sessions.remove(session_id)
+
+        # Descartar también las sesiones restauradas que expiraron sin usarse
+        expired = [session_id for session_id, (_, _, _, last_activity) in self.restored_index.items()
+                   if self._is_expired(last_activity, current_time)]
+        for session_id in expired:
+            self._release_snapshot_map(self.restored_index.pop(session_id)[0])
+
+    def _is_expired(self, last_activity, current_time=None):
+        current_time = current_time or datetime.now()
+        return (current_time - last_activity).total_seconds() >= self.session_timeout
+
+    def save_snapshot(self, path):
+        """Escribe sesiones y métricas en un archivo binario, registro por registro"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        count = 0
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            metrics_payload = pickle.dumps(self.metrics, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(SNAPSHOT_METRICS.pack(len(metrics_payload)))
+            f.write(metrics_payload)
+
+            for session_id, data in list(self.sessions.cache.items()):
+                payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+                self._write_snapshot_record(f, session_id, data['last_activity'], payload)
+                count += 1
+
+            # Las sesiones restauradas que no se han tocado se copian tal cual,
+            # sin deserializarlas
+            for session_id, (snapshot_map, offset, length, last_activity) in list(self.restored_index.items()):
+                if session_id in self.sessions or self._is_expired(last_activity):
+                    continue
+                payload = snapshot_map[offset:offset + length]
+                self._write_snapshot_record(f, session_id, last_activity, payload)
+                count += 1
+        os.replace(tmp_path, path)
+        logger.info(f"Snapshot de sesiones guardado en {path} ({count} sesiones)")
+        return count
+
+    def _write_snapshot_record(self, f, session_id, last_activity, payload):
+        session_key = session_id.encode('utf-8')
+        f.write(SNAPSHOT_RECORD.pack(len(session_key), last_activity.timestamp(), len(payload)))
+        f.write(session_key)
+        f.write(payload)
+
+    def restore_snapshot(self, path):
+        """Indexa un snapshot mapeado en memoria; las sesiones se cargan al primer uso.
+
+        Se puede llamar con varios archivos (uno por worker anterior): las métricas se
+        suman y ante sesiones repetidas queda la de actividad más reciente.
+        """
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return 0
+
+        snapshot_file = open(path, 'rb')
+        try:
+            snapshot_map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            snapshot_file.close()
+            return 0
+
+        if snapshot_map[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            logger.warning(f"Snapshot de sesiones inválido: {path}")
+            snapshot_map.close()
+            snapshot_file.close()
+            return 0
+
+        offset = len(SNAPSHOT_MAGIC)
+        try:
+            (metrics_length,) = SNAPSHOT_METRICS.unpack_from(snapshot_map, offset)
+            offset += SNAPSHOT_METRICS.size
+            self._merge_metrics(self.metrics, pickle.loads(snapshot_map[offset:offset + metrics_length]))
+            offset += metrics_length
+        except Exception as e:
+            logger.warning(f"Métricas ilegibles en el snapshot {path}: {e}")
+            snapshot_map.close()
+            snapshot_file.close()
+            return 0
+
+        now = datetime.now()
+        restored = 0
+        skipped = 0
+        while offset + SNAPSHOT_RECORD.size <= len(snapshot_map):
+            key_length, timestamp, payload_length = SNAPSHOT_RECORD.unpack_from(snapshot_map, offset)
+            if offset + SNAPSHOT_RECORD.size + key_length + payload_length > len(snapshot_map):
+                logger.warning(f"Snapshot de sesiones truncado: {path}")
+                break
+            offset += SNAPSHOT_RECORD.size
+            session_id = snapshot_map[offset:offset + key_length].decode('utf-8', errors='replace')
+            offset += key_length
+            last_activity = datetime.fromtimestamp(timestamp)
+            previous = self.restored_index.get(session_id)
+            if self._is_expired(last_activity, now):
+                skipped += 1
+            elif previous is None or previous[3] < last_activity:
+                if previous is not None:
+                    self._release_snapshot_map(previous[0])
+                self.restored_index[session_id] = (snapshot_map, offset, payload_length, last_activity)
+                restored += 1
+            offset += payload_length
+
+        self._snapshot_maps[snapshot_map] = [snapshot_file, restored]
+        if restored == 0:
+            self._release_snapshot_map(snapshot_map)
+        logger.info(f"Snapshot de sesiones restaurado desde {path} ({restored} sesiones, {skipped} expiradas)")
+        return restored
+
+    def _merge_metrics(self, target, loaded):
+        """Suma las métricas de un snapshot a las actuales"""
+        for key, value in loaded.items():
+            if key in ('active_sessions', 'avg_messages_per_session'):
+                continue  # se recalculan en update_metrics
+            current = target.get(key)
+            if isinstance(value, dict) and isinstance(current, dict):
+                self._merge_metrics(current, value)
+            elif isinstance(value, list) and isinstance(current, list):
+                current.extend(value)
+                del current[:-1000]
+            elif isinstance(value, (int, float)) and isinstance(current, (int, float)):
+                target[key] = current + value
+            else:
+                target[key] = value
+
+    def _release_snapshot_map(self, snapshot_map):
+        """Descuenta una sesión pendiente del mmap y lo cierra junto a su archivo al llegar a cero"""
+        entry = self._snapshot_maps.get(snapshot_map)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._snapshot_maps[snapshot_map]
+            snapshot_map.close()
+            entry[0].close()
+
+    def _load_restored_session(self, session_id):
+        snapshot_map, offset, length, last_activity = self.restored_index.pop(session_id)
+        try:
+            if self._is_expired(last_activity):
+                return None
+            session_data = pickle.loads(snapshot_map[offset:offset + length])
+        except Exception as e:
+            # Payload dañado: se descarta y el usuario empieza una sesión nueva
+            logger.warning(f"Sesión restaurada ilegible, se descarta: {e}")
+            return None
+        finally:
+            self._release_snapshot_map(snapshot_map)
+        self.sessions.put(session_id, session_data, estimate_session_size(session_data))
+        return session_data
+
+    def update_session_size(self, session_id):
+        session_data = self.sessions.cache.get(session_id)
+        if session_data is not None:
+            self.sessions.resize(session_id, estimate_session_size(session_data))
+
+    def get_memory_usage(self, top=10):
+        """Uso de memoria aproximado de las estructuras del manejador de sesiones"""
+        largest = sorted(self.sessions.sizes.items(), key=lambda x: x[1], reverse=True)[:top]
+        return {
+            'sessions': len(self.sessions.cache),
+            'session_bytes': self.sessions.total_bytes,
+            'session_budget_bytes': self.sessions.max_bytes,
+            'session_evictions': self.sessions.evictions,
+            'largest_sessions': [{'session': session_id[:8], 'bytes': size} for session_id, size in largest],
+            'restored_pending': len(self.restored_index),
+            'snapshot_mapped_bytes': sum(len(snapshot_map) for snapshot_map in self._snapshot_maps),
+            'response_times_bytes': sys.getsizeof(self.metrics['response_times'])
+        }
 
 class Chatbot:
-    def __init__(self, max_messages_per_session=50):
+    def __init__(self, max_messages_per_session=50, prefetch_max_concurrent=PREFETCH_MAX_CONCURRENT, precomputed=None):
         self.max_messages = max_messages_per_session
         self.session_manager = SessionManager()
+        # Sesiones con un prefetch en curso; el resultado se guarda en session_data['prefetched']
+        self.prefetch_in_flight = set()
+        self.prefetch_lock = threading.Lock()
+        self.prefetch_slots = threading.BoundedSemaphore(prefetch_max_concurrent) if prefetch_max_concurrent > 0 else None
         self.knowledge_base = {
             'bono_productividad': {
                 'context': '''
@@ -376,25 +1040,96 @@ class Chatbot:
                 'keywords': ['pasaje', 'pasajes', 'descuento', 'descuentos', 'vuelo', 'vuelos', 'boleto', 'boletos', 'ticket', 'tickets', 'tarifa', 'tarifas', 'reserva', 'reservas']
             }
         }
+        # Keywords normalizadas e índice difuso: desde el artefacto de arranque si sigue vigente
+        self.keywords_fingerprint = self._keywords_fingerprint()
+        if precomputed and precomputed.get('fingerprint') == self.keywords_fingerprint:
+            self.topic_keywords = precomputed['topic_keywords']
+            self.fuzzy_index = FuzzyKeywordIndex.from_state(precomputed['fuzzy_index'])
+        else:
+            self.topic_keywords = {
+                topic: [normalize(keyword) for keyword in data['keywords']]
+                for topic, data in self.knowledge_base.items()
+            }
+            self.fuzzy_index = FuzzyKeywordIndex(self.topic_keywords)
+        self.topic_tokens = {topic: {token for keyword in keywords for token in TOKEN_PATTERN.findall(keyword)}
+                             for topic, keywords in self.topic_keywords.items()}
+
+    def _keywords_fingerprint(self):
+        keywords = {topic: data['keywords'] for topic, data in self.knowledge_base.items()}
+        source = json.dumps([keywords, FUZZY_MIN_LENGTH], sort_keys=True)
+        return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def precomputed_state(self):
+        return {
+            'fingerprint': self.keywords_fingerprint,
+            'topic_keywords': self.topic_keywords,
+            'fuzzy_index': self.fuzzy_index.state()
+        }
 
     def normalize_text(self, text):
         """Normaliza el texto eliminando tildes y caracteres especiales"""
-        # Convertir a minúsculas
-        text = text.lower()
-        # Eliminar tildes
-        text = ''.join(c for c in unicodedata.normalize('NFD', text)
-                      if unicodedata.category(c) != 'Mn')
-        return text
+        return normalize(text)
+
+    def analyze_message(self, message):
+        """Normaliza, tokeniza y extrae entidades y temas de un mensaje"""
+        text = message.lower().strip()
+        normalized = text.translate(ACCENT_TABLE)
+
+        entities = {}
+        base_match = BASE_PATTERN.search(normalized)
+        if base_match:
+            entities['base'] = base_match.group(1)
+        for pattern, label in TIME_PATTERNS.items():
+            if pattern in normalized:
+                entities['tiempo'] = label
+        for declaration, role in ROLE_DECLARATIONS.items():
+            if declaration in normalized:
+                entities['role'] = role
+                break
+        if any(farewell in normalized for farewell in FAREWELLS):
+            entities['farewell'] = 'thanks' if 'gracias' in normalized or 'thank' in normalized else 'bye'
+        if any(greeting in normalized for greeting in GREETINGS):
+            entities['greeting'] = True
+
+        topic_scores = {
+            topic: sum(1 for keyword in keywords if keyword in normalized)
+            for topic, keywords in self.topic_keywords.items()
+        }
+
+        # Coincidencias aproximadas ("vacasiones", "viatcos") con menor peso
+        tokens = TOKEN_PATTERN.findall(normalized)
+        fuzzy_keywords = set()
+        for token in tokens:
+            fuzzy_keywords |= self.fuzzy_index.lookup(token)
+        for keyword in fuzzy_keywords:
+            if keyword not in normalized:
+                for topic in self.fuzzy_index.keyword_topics[keyword]:
+                    topic_scores[topic] += FUZZY_MATCH_WEIGHT
+        return AnalyzedMessage(text, normalized, tokens, entities, topic_scores)
+
+    def _message_analysis(self, msg):
+        """Temas y entidades guardados en el historial (o calculados si faltan)"""
+        if 'topics' not in msg:
+            analyzed = self.analyze_message(msg['text'])
+            msg['topics'] = analyzed.topics
+            msg['entities'] = analyzed.entities
+        return msg['topics'], msg['entities']
 
     def initialize_user_session(self, session_id):
         return self.session_manager.get_session(session_id)
 
-    def add_message_to_history(self, session_data, message, is_user=True):
+    def add_message_to_history(self, session_data, message, is_user=True, analyzed=None):
         messages = session_data['messages']
+        # Contador de turnos: a diferencia del largo del historial, no se detiene en max_messages
+        session_data['turns'] = session_data.get('turns', 0) + 1
+        if analyzed is None:
+            analyzed = self.analyze_message(message)
         messages.append({
             'text': message,
             'is_user': is_user,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': datetime.now().isoformat(),
+            'topics': analyzed.topics,
+            'entities': analyzed.entities
         })
         
         # Mantener solo los últimos max_messages mensajes
@@ -413,36 +1148,24 @@ class Chatbot:
             prefix = "Usuario:" if msg['is_user'] else "Asistente:"
             context.append(f"{prefix} {msg['text']}")
             
-            # Analizar el mensaje para extraer información relevante
-            text = msg['text'].lower()
+            # Temas y entidades ya extraídos al agregar el mensaje al historial
+            topics, entities = self._message_analysis(msg)
             
             # Detectar temas mencionados
-            for topic, data in self.knowledge_base.items():
-                if any(keyword in text for keyword in data['keywords']):
-                    if topic not in topics_mentioned:
-                        topics_mentioned.append(topic)
+            for topic in topics:
+                if topic not in topics_mentioned:
+                    topics_mentioned.append(topic)
             
             # Detectar preferencias del usuario
             if msg['is_user']:
-                # Detectar menciones de tiempo
-                time_patterns = ['mañana', 'tarde', 'noche', 'día', 'mes', 'semana']
-                for pattern in time_patterns:
-                    if pattern in text:
-                        user_preferences['tiempo_preferido'] = pattern
-                
-                # Detectar menciones de ubicación
-                if any(word in text for word in ['base', 'ciudad', 'aeropuerto']):
-                    location = re.findall(r'(?:base|ciudad|aeropuerto)\s+(?:de\s+)?([a-zA-Z\s]+)', text)
-                    if location:
-                        user_preferences['ubicacion'] = location[0]
+                if 'tiempo' in entities:
+                    user_preferences['tiempo_preferido'] = entities['tiempo']
+                if 'base' in entities:
+                    user_preferences['ubicacion'] = entities['base']
             
             # Registrar el flujo de la conversación
             if len(conversation_flow) < 5:  # Mantener los últimos 5 cambios de tema
-                current_topic = None
-                for topic, data in self.knowledge_base.items():
-                    if any(keyword in text for keyword in data['keywords']):
-                        current_topic = topic
-                        break
+                current_topic = topics[0] if topics else None
                 if current_topic and (not conversation_flow or conversation_flow[-1] != current_topic):
                     conversation_flow.append(current_topic)
             
@@ -466,22 +1189,84 @@ class Chatbot:
             return context.format(role=role.title(), role_info=role_info)
         return context
 
+    def get_topic_context(self, topic, role):
+        context = self.knowledge_base[topic]['context']
+        if role:
+            return self.get_role_specific_context(context, role, topic)
+        return context.replace("{role}s: {role_info}", "todos los roles").replace("{base_amount}", "$439.590").replace("{daily_amount}", "$65.938")
+
+    def is_plain_topic_question(self, analyzed, topic):
+        """True si el mensaje solo pregunta por el tema: cada palabra es una keyword del
+        tema (exacta o con error de tipeo) o una palabra de PLAIN_QUESTION_WORDS"""
+        topic_tokens = self.topic_tokens[topic]
+        for token in analyzed.tokens:
+            if token in topic_tokens or token in PLAIN_QUESTION_WORDS:
+                continue
+            if not any(topic in self.fuzzy_index.keyword_topics[keyword] for keyword in self.fuzzy_index.lookup(token)):
+                return False
+        return True
+
+    def get_prefetched_response(self, session_data, topic, analyzed):
+        """Consume la respuesta especulativa de la sesión si su siguiente mensaje es una
+        pregunta simple sobre el tema predicho; en cualquier otro caso se descarta, porque
+        la respuesta se generó para "Cuéntame sobre <tema>" y no para detalles concretos"""
+        prefetched = session_data.pop('prefetched', None)
+        if prefetched is None:
+            return None
+        # El mensaje del usuario ya está en el historial: debe ser el turno siguiente al predicho
+        if (prefetched['topic'] != topic or prefetched['turn'] != session_data.get('turns', 0) - 1 or
+                (datetime.now() - prefetched['created']).total_seconds() > PREFETCH_TTL or
+                not self.is_plain_topic_question(analyzed, topic)):
+            return None
+        return prefetched['response']
+
+    def schedule_prefetch(self, session_id, session_data, topic):
+        """Genera en segundo plano la respuesta al tema que probablemente siga en esta sesión"""
+        if self.prefetch_slots is None or self.session_manager.token_budget_exhausted():
+            return
+        next_topic = self.session_manager.predict_next_topic(topic)
+        if next_topic is None:
+            return
+
+        with self.prefetch_lock:
+            if session_id in self.prefetch_in_flight:
+                return
+            if not self.prefetch_slots.acquire(blocking=False):
+                self.session_manager.metrics['prefetch']['skipped'] += 1
+                return
+            self.prefetch_in_flight.add(session_id)
+        self.session_manager.metrics['prefetch']['started'] += 1
+        threading.Thread(target=self._prefetch, args=(session_id, session_data, next_topic), daemon=True).start()
+
+    def _prefetch(self, session_id, session_data, topic):
+        try:
+            # Copia del historial al momento de predecir: la respuesta mantiene el contexto de la conversación
+            history = {'role': session_data['role'], 'messages': list(session_data['messages'])}
+            turn = session_data.get('turns', 0)
+            context = self.get_topic_context(topic, history['role'])
+            query = f"Cuéntame sobre {topic.replace('_', ' ')}"
+            response = self.get_ai_response(query, context, history, topic=topic)
+            if response and session_data.get('turns', 0) == turn:
+                session_data['prefetched'] = {'topic': topic, 'turn': turn, 'response': response,
+                                              'created': datetime.now()}
+        finally:
+            with self.prefetch_lock:
+                self.prefetch_in_flight.discard(session_id)
+            self.prefetch_slots.release()
+
     def get_most_similar_topic(self, query):
-        normalized_query = self.normalize_text(query)
+        analyzed = query if isinstance(query, AnalyzedMessage) else self.analyze_message(query)
         best_score = 0
         best_topic = None
         
-        for topic, data in self.knowledge_base.items():
-            # Normalizar cada keyword y buscar en el query normalizado
-            score = sum(1 for keyword in data['keywords'] 
-                       if self.normalize_text(keyword) in normalized_query)
+        for topic, score in analyzed.topic_scores.items():
             if score > best_score:
                 best_score = score
                 best_topic = topic
         
         return best_topic if best_score > 0 else None
 
-    def get_ai_response(self, query, context, session_data):
+    def get_ai_response(self, query, context, session_data, topic=None):
         try:
             # Obtener contexto enriquecido de la conversación
             conv_context = self.get_conversation_context(session_data['messages'])
@@ -525,38 +1310,49 @@ Instrucciones especiales:
                 {"role": "user", "content": query}
             ]
             
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
+            response = get_openai().ChatCompletion.create(
+                model=OPENAI_MODEL,
                 messages=messages,
                 temperature=0.7,
-                max_tokens=300
+                max_tokens=300,
+                request_timeout=OPENAI_TIMEOUT
             )
+            usage = response.get('usage')
+            if usage:
+                self.session_manager.record_token_usage(topic, session_data['role'],
+                                                        usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
             return response.choices[0].message['content']
         except Exception as e:
             logger.error(f"Error al llamar a OpenAI: {e}")
             return None
 
     def get_response(self, message, session_id):
+        try:
+            return self._build_response(message, session_id)
+        finally:
+            # La sesión crece con cada respuesta: recontabilizar su tamaño
+            self.session_manager.update_session_size(session_id)
+
+    def _build_response(self, message, session_id):
         start_time = datetime.now()
         session_data = self.initialize_user_session(session_id)
-        message = message.lower().strip()
+        analyzed = self.analyze_message(message)
+        message = analyzed.text
+        entities = analyzed.entities
         
         # Agregar mensaje del usuario al historial
-        self.add_message_to_history(session_data, message, is_user=True)
+        self.add_message_to_history(session_data, message, is_user=True, analyzed=analyzed)
         
         # Detectar la base de operación si se menciona
-        base_patterns = r'(?:base|ciudad|aeropuerto)\s+(?:de\s+)?([a-zA-Z\s]+)'
-        base_match = re.search(base_patterns, message)
-        if base_match:
-            session_data['base'] = base_match.group(1)
+        if 'base' in entities:
+            session_data['base'] = entities['base']
         
         # Detectar despedidas y agradecimientos
-        despedidas = ['adios', 'adiós', 'chao', 'hasta luego', 'nos vemos', 'bye', 'gracias', 'muchas gracias', 'thank you', 'thanks']
-        if any(despedida in message for despedida in despedidas):
+        if 'farewell' in entities:
             role_text = f"{session_data['role']}" if session_data['role'] else "tripulante"
             emoji = "🛫" if role_text == "tripulante" else "✈️" if role_text == "capitan" else "🛩️"
             
-            if 'gracias' in message or 'thank' in message:
+            if entities['farewell'] == 'thanks':
                 response = f"""¡Ha sido un placer ayudarte! {emoji} Como tu asistente virtual, siempre estoy aquí para responder tus dudas sobre beneficios, turnos, vacaciones o cualquier otra consulta que tengas. ¡Que tengas excelentes vuelos! 
 
 Si necesitas más información en el futuro, no dudes en preguntarme. ¡Hasta pronto! 👋"""
@@ -569,47 +1365,63 @@ Si necesitas más información en el futuro, estaré encantado/a de asistirte nu
             return response
         
         # Manejar cambio de rol en cualquier momento
-        if 'soy tripulante' in message:
+        declared_role = entities.get('role')
+        if declared_role == 'tripulante':
             session_data['role'] = 'tripulante'
             response = "¡Bienvenido/a a bordo! 🛫 Te atenderé como Tripulante de Cabina. ¿En qué puedo ayudarte hoy?"
             self.add_message_to_history(session_data, response, is_user=False)
             return response
-        elif 'soy piloto' in message:
+        elif declared_role == 'piloto':
             session_data['role'] = 'piloto'
             response = "¡Bienvenido/a al cockpit! 🛩️ Te atenderé como Piloto. ¿En qué puedo asistirte hoy?"
             self.add_message_to_history(session_data, response, is_user=False)
             return response
-        elif 'soy capitan' in message or 'soy capitán' in message:
+        elif declared_role == 'capitan':
             session_data['role'] = 'capitan'
             response = "¡Bienvenido/a, Comandante! ✈️ Te atenderé como Capitán. ¿En qué puedo ayudarte hoy?"
             self.add_message_to_history(session_data, response, is_user=False)
             return response
         
         # Detectar saludos solo si es el primer mensaje
-        saludos = ['hola', 'buenos dias', 'buenos días', 'buenas tardes', 'buenas noches', 'hi', 'hello']
-        if any(saludo in message for saludo in saludos) and len(session_data['messages']) <= 2:
+        if entities.get('greeting') and len(session_data['messages']) <= 2:
             response = "¡Hola! 👋 Soy CrewSMART, tu asistente virtual para tripulaciones de JetSmart. Estoy aquí para ayudarte con información sobre bonos, turnos, vacaciones y más. ¿En qué puedo asistirte hoy?"
             self.add_message_to_history(session_data, response, is_user=False)
             return response
         
         # Buscar tema relacionado
-        best_topic = self.get_most_similar_topic(message)
+        best_topic = self.get_most_similar_topic(analyzed)
         
         if best_topic:
-            context = self.knowledge_base[best_topic]['context']
-            
-            if session_data['role']:
-                context = self.get_role_specific_context(context, session_data['role'], best_topic)
-            else:
-                context = context.replace("{role}s: {role_info}", "todos los roles").replace("{base_amount}", "$439.590").replace("{daily_amount}", "$65.938")
+            context = self.get_topic_context(best_topic, session_data['role'])
             
+            previous_topic = session_data['last_topic']
+            if previous_topic and previous_topic != best_topic:
+                self.session_manager.record_topic_transition(previous_topic, best_topic)
             session_data['last_topic'] = best_topic
-            ai_response = self.get_ai_response(message, context, session_data)
+            profiler.tag(best_topic)
+            
+            # Usar la respuesta especulativa si esta sesión siguió la transición predicha
+            ai_response = self.get_prefetched_response(session_data, best_topic, analyzed)
+            prefetch_metrics = self.session_manager.metrics['prefetch']
+            if ai_response:
+                prefetch_metrics['hits'] += 1
+            elif self.session_manager.token_budget_exhausted():
+                # Presupuesto de tokens agotado: responder solo con la base de conocimiento
+                self.session_manager.metrics['token_usage']['degraded_responses'] += 1
+                kb_response = context.strip()
+                self.add_message_to_history(session_data, kb_response, is_user=False)
+                response_time = (datetime.now() - start_time).total_seconds()
+                self.session_manager.update_metrics(session_data, topic=best_topic, response_time=response_time)
+                return kb_response
+            else:
+                prefetch_metrics['misses'] += 1
+                ai_response = self.get_ai_response(message, context, session_data, topic=best_topic)
             
             if ai_response:
                 self.add_message_to_history(session_data, ai_response, is_user=False)
                 response_time = (datetime.now() - start_time).total_seconds()
                 self.session_manager.update_metrics(session_data, topic=best_topic, response_time=response_time)
+                self.schedule_prefetch(session_id, session_data, best_topic)
                 return ai_response
             
             return context.strip()
@@ -632,16 +1444,147 @@ Puedo brindarte información sobre:
         self.session_manager.update_metrics(session_data, response_time=response_time)
         return generic_response
 
-chatbot = Chatbot()
+startup_artifact = load_startup_artifact()
+chatbot = Chatbot(precomputed=startup_artifact.get('chatbot'))
+static_assets = load_static_assets(cached=startup_artifact.get('static_assets'))
+cached_etags = {filename: state['etag'] for filename, state in startup_artifact.get('static_assets', {}).items()}
+if (startup_artifact.get('chatbot', {}).get('fingerprint') != chatbot.keywords_fingerprint or
+        cached_etags != {filename: asset.etag for filename, asset in static_assets.items()}):
+    # El artefacto solo contiene tipos básicos para poder cargarlo sin importar este módulo
+    save_startup_artifact({
+        'version': STARTUP_ARTIFACT_VERSION,
+        'chatbot': chatbot.precomputed_state(),
+        'static_assets': {filename: asset.state() for filename, asset in static_assets.items()}
+    })
+del cached_etags
+del startup_artifact
+
+def serve_static_asset(filename):
+    asset = static_assets[filename]
+    if request.if_none_match.contains_weak(asset.etag):
+        response = app.response_class(status=304)
+    else:
+        encoding = choose_encoding(request.accept_encodings)
+        response = app.response_class(asset.encoded[encoding], mimetype=asset.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    # ETag débil: el mismo recurso se entrega con distintas codificaciones
+    response.set_etag(asset.etag, weak=True)
+    response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}'
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Comprime respuestas dinámicas sobre COMPRESSION_MIN_BYTES"""
+    if (response.status_code != 200 or response.direct_passthrough or
+            'Content-Encoding' in response.headers or
+            response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding:
+        response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def require_admin(view):
+    """Protege un endpoint con el header X-Admin-Token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get('X-Admin-Token', '')
+        if not ADMIN_TOKEN or not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return jsonify({'error': 'No autorizado'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def save_session_snapshot():
+    if not SESSION_SNAPSHOT_PATH:
+        return
+    try:
+        # Un archivo por proceso: los workers de gunicorn reciben SIGTERM a la vez
+        chatbot.session_manager.save_snapshot(f"{SESSION_SNAPSHOT_PATH}.{os.getpid()}")
+    except Exception as e:
+        logger.error(f"Error al guardar snapshot de sesiones: {e}")
+
+def claim_session_snapshots(path=SESSION_SNAPSHOT_PATH):
+    """Reclama los snapshots de los workers anteriores renombrándolos, para que cada
+    archivo lo restaure un solo worker aunque todos arranquen a la vez"""
+    candidates = [path] + [candidate for candidate in glob.glob(f"{glob.escape(path)}.*")
+                           if candidate.rsplit('.', 1)[1].isdigit()]
+    claimed = []
+    for candidate in candidates:
+        target = f"{candidate}.claimed-{os.getpid()}"
+        try:
+            os.rename(candidate, target)
+        except OSError:
+            continue  # no existe o lo reclamó otro worker
+        claimed.append(target)
+    return claimed
+
+def is_reloader_parent():
+    """True en el proceso padre del reloader de Werkzeug, que solo vigila archivos y
+    relanza al hijo; el bloque __main__ siempre corre con debug=True"""
+    debug = app.debug or __name__ == '__main__'
+    return debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
+def install_snapshot_handlers():
+    """Restaura el snapshot al arrancar y lo guarda al recibir SIGTERM"""
+    # El padre del reloader no atiende peticiones: si reclamara los snapshots, el hijo
+    # arrancaría sin sesiones y el padre sobrescribiría el archivo al salir
+    if not SESSION_SNAPSHOT_PATH or is_reloader_parent():
+        return
+    for claimed_path in claim_session_snapshots():
+        try:
+            chatbot.session_manager.restore_snapshot(claimed_path)
+        except Exception as e:
+            logger.error(f"Error al restaurar snapshot de sesiones: {e}")
+        try:
+            # El mapeo en memoria sigue siendo válido después de borrar el archivo
+            os.remove(claimed_path)
+        except OSError as e:
+            logger.warning(f"No se pudo borrar el snapshot restaurado {claimed_path}: {e}")
+
+    previous_handler = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        save_session_snapshot()
+        # Dejar que el handler anterior (p.ej. el de gunicorn) termine el proceso
+        atexit.unregister(save_session_snapshot)
+        if callable(previous_handler):
+            previous_handler(signum, frame)
+        elif previous_handler != signal.SIG_IGN:
+            raise SystemExit(0)
+
+    try:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        # Solo se pueden instalar handlers desde el hilo principal
+        logger.warning("No se pudo instalar el handler de SIGTERM para snapshots")
+    atexit.register(save_session_snapshot)
+
+install_snapshot_handlers()
 
 @app.route('/')
+@app.route('/frontend.html')
 def serve_frontend():
     try:
-        return send_from_directory('.', 'frontend.html')
+        return serve_static_asset('frontend.html')
     except Exception as e:
         logger.error(f"Error al servir frontend.html: {e}")
         return "Error al cargar la página", 500
 
+@app.route('/index.html')
+def serve_index():
+    try:
+        return serve_static_asset('index.html')
+    except Exception as e:
+        logger.error(f"Error al servir index.html: {e}")
+        return "Error al cargar la página", 500
+
 @app.route('/chat', methods=['POST'])
 def chat():
     try:
@@ -662,10 +1605,82 @@ def chat():
             'session_id': session_id
         }
         
-        return jsonify(response_data)
+        http_response = jsonify(response_data)
+        if request.cookies.get('session_id') != session_id:
+            http_response.set_cookie('session_id', session_id, max_age=chatbot.session_manager.session_timeout,
+                                     httponly=True, samesite='Lax')
+        return http_response
     except Exception as e:
         logger.error(f"Error en el endpoint /chat: {e}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        profiler.clear_tag()
+
+@app.route('/debug/profile', methods=['POST'])
+@require_admin
+def start_profile():
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.005))
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+    if not math.isfinite(seconds) or not math.isfinite(interval) or seconds <= 0:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+    if not profiler.start(seconds, interval):
+        return jsonify({'error': 'Ya hay un perfilado en curso', 'status': profiler.status()}), 409
+    # El profiler es por worker: con wait=1 las pilas se devuelven en esta misma respuesta,
+    # sin depender de que el GET posterior llegue al mismo proceso
+    if request.args.get('wait') == '1':
+        profiler.wait()
+        return profiler.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    return jsonify(profiler.status()), 202
+
+@app.route('/debug/profile', methods=['GET'])
+@require_admin
+def get_profile():
+    if request.args.get('format') == 'json':
+        return jsonify(profiler.status())
+    return profiler.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+def read_rss_bytes():
+    """RSS actual del proceso (solo Linux); None si no está disponible"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+@app.route('/debug/memory')
+@require_admin
+def debug_memory():
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+
+    report = {
+        'rss_bytes': read_rss_bytes(),
+        'session_manager': chatbot.session_manager.get_memory_usage(top=limit),
+        'profiler_stacks': len(profiler.stacks),
+        'tracemalloc': None
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        statistics = tracemalloc.take_snapshot().statistics('lineno')[:limit]
+        report['tracemalloc'] = {
+            'current_bytes': current,
+            'peak_bytes': peak,
+            'top_allocations': [
+                {'site': str(stat.traceback[0]), 'bytes': stat.size, 'count': stat.count}
+                for stat in statistics
+            ]
+        }
+    return jsonify(report)
+
+@app.route('/metrics')
+@require_admin
+def metrics_json():
+    return jsonify(chatbot.session_manager.get_metrics())
 
 @app.route('/dashboard')
 def dashboard():
@@ -681,7 +1696,7 @@ def dashboard():
         roles_labels = [item[0] for item in roles_data] if roles_data else []
         roles_values = [item[1] for item in roles_data] if roles_data else []
 
-        return f'''
+        html = f'''
         <!DOCTYPE html>
         <html>
         <head>
@@ -703,7 +1718,7 @@ def dashboard():
                 .metrics-row {{
                     grid-column: 1 / -1;
                     display: grid;
-                    grid-template-columns: repeat(4, 1fr);
+                    grid-template-columns: repeat(6, 1fr);
                     gap: 20px;
                 }}
                 .card {{
@@ -781,6 +1796,14 @@ def dashboard():
                         <h2>Tiempo Respuesta</h2>
                         <div class="metric">{metrics['avg_response_time']}s</div>
                     </div>
+                    <div class="card small-metric">
+                        <h2>Aciertos Prefetch</h2>
+                        <div class="metric">{metrics['prefetch']['hit_rate']:.0%}</div>
+                    </div>
+                    <div class="card small-metric">
+                        <h2>Tokens Hoy</h2>
+                        <div class="metric">{metrics['token_usage']['today']}{f" / {metrics['token_usage']['daily_budget']}" if metrics['token_usage']['daily_budget'] else ''}</div>
+                    </div>
                 </div>
                 <div class="card chart-card">
                     <h2>Temas Más Consultados</h2>
@@ -896,6 +1919,10 @@ def dashboard():
         </body>
         </html>
         '''
+        response = app.response_class(html, mimetype='text/html')
+        response.add_etag(weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"Error en el dashboard: {e}")
         return "Error al cargar el dashboard", 500
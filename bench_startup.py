@@ -0,0 +1,82 @@
+"""Benchmark de arranque en frío: tiempo desde `import app_new` hasta la primera respuesta.
+
+Cada medición corre en un proceso nuevo. Termina con código 1 si la mediana supera
+--max-ms o si alguna dependencia pesada se importa antes de necesitarla, para usarlo
+como chequeo en CI:
+
+    python bench_startup.py --runs 5 --max-ms 500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Módulos que no deben cargarse para responder un saludo
+LAZY_MODULES = ['openai']
+
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {app_dir!r})
+import app_new
+imported = time.perf_counter()
+response = app_new.app.test_client().post('/chat', json={{'message': 'hola'}})
+first_response = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'first_response_ms': (first_response - start) * 1000,
+    'status': response.status_code,
+    'eager_modules': [m for m in {lazy_modules!r} if m in sys.modules]
+}}))
+"""
+
+def measure_once(use_artifact):
+    env = dict(os.environ)
+    # Sin snapshot de sesiones para no leer ni escribir estado entre corridas
+    env['SESSION_SNAPSHOT_PATH'] = ''
+    if not use_artifact:
+        env['STARTUP_ARTIFACT_PATH'] = ''
+    script = CHILD_SCRIPT.format(app_dir=APP_DIR, lazy_modules=LAZY_MODULES)
+    result = subprocess.run([sys.executable, '-c', script], env=env, cwd=APP_DIR,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de arranque en frío')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=float(os.getenv('STARTUP_MAX_MS', '500')),
+                        help='umbral para la mediana de import + primera respuesta')
+    parser.add_argument('--no-artifact', action='store_true', help='medir sin el artefacto de arranque')
+    args = parser.parse_args()
+
+    use_artifact = not args.no_artifact
+    if use_artifact:
+        # Una corrida previa genera el artefacto si falta o está desactualizado
+        measure_once(use_artifact)
+
+    samples = [measure_once(use_artifact) for _ in range(args.runs)]
+    import_ms = statistics.median(s['import_ms'] for s in samples)
+    first_response_ms = statistics.median(s['first_response_ms'] for s in samples)
+    eager_modules = sorted({m for s in samples for m in s['eager_modules']})
+    failed_requests = sum(1 for s in samples if s['status'] != 200)
+
+    print(f"import: {import_ms:.1f}ms (mediana), import + primera respuesta: {first_response_ms:.1f}ms "
+          f"(mediana de {args.runs}, umbral {args.max_ms:.0f}ms)")
+
+    failures = []
+    if first_response_ms > args.max_ms:
+        failures.append(f"el arranque superó el umbral ({first_response_ms:.1f}ms > {args.max_ms:.0f}ms)")
+    if eager_modules:
+        failures.append(f"módulos importados antes de usarse: {', '.join(eager_modules)}")
+    if failed_requests:
+        failures.append(f"{failed_requests} respuestas con error")
+    for failure in failures:
+        print(f"FALLO: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
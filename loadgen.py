@@ -0,0 +1,241 @@
+"""Generador de carga de extremo a extremo para /chat.
+
+Reproduce conversaciones multi-turno de tripulantes a un RPS objetivo; cada usuario
+virtual mantiene su propia cookie de sesión. Ejemplos:
+
+    # Contra una instancia ya levantada
+    python loadgen.py --url http://localhost:5000 --rps 20 --duration 60
+
+    # Levantando la app con distintas cantidades de workers (usar junto a mock_llm.py)
+    python loadgen.py --rps 50 --duration 30 --workers 1,2,4 \\
+        --serve-cmd "gunicorn -w {workers} -b 127.0.0.1:{port} app_new:app"
+
+Las conversaciones pueden cargarse desde un archivo JSONL con --conversations; cada
+línea puede tener `messages` (lista de turnos), `message` o `body` (un solo turno).
+"""
+import argparse
+import http.client
+import http.cookiejar
+import json
+import os
+import queue
+import random
+import shlex
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CONVERSATIONS = [
+    ['Hola', 'Soy tripulante', '¿Cómo funcionan las vacaciones?', '¿Y en temporada baja hay bono?', 'Gracias'],
+    ['Soy piloto', '¿Cómo se calcula el bono de productividad?', 'Si vuelo 83 horas, ¿cuánto bono recibo?', 'Chao'],
+    ['Hola', 'Mi vuelo se retrasó 3 horas, ¿tengo viáticos?', '¿Y si lo cancelan fuera de base?', '¿Cómo activo el seguro?'],
+    ['Soy capitán', '¿Cuánto es el bono de instructor?', '¿Y el simulador cómo se paga?', 'Muchas gracias'],
+    ['¿Qué pasa si trabajo un feriado?', '¿Puedo pedir pago en vez del día libre?', 'Adiós'],
+    ['Soy tripulante', '¿Cómo obtengo descuentos en pasajes?', '¿Aplica para mis familiares?', 'Gracias'],
+    ['¿Cuántos turnos de retén puedo tener al mes?', '¿Cuánto me pagan por turno extra?'],
+]
+
+def load_conversations(path):
+    conversations = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if isinstance(entry.get('messages'), list):
+                conversations.append([str(m) for m in entry['messages'] if m])
+            elif entry.get('message') or entry.get('body'):
+                conversations.append([entry.get('message') or entry['body']])
+    return [c for c in conversations if c]
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+class VirtualUser:
+    """Usuario con su propia cookie de sesión que recorre una conversación turno a turno"""
+    def __init__(self, url, conversations, rng, timeout):
+        self.url = url
+        self.conversations = conversations
+        self.rng = rng
+        self.timeout = timeout
+        self._new_conversation()
+
+    def _new_conversation(self):
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        self.turns = list(self.rng.choice(self.conversations))
+        self.position = 0
+
+    def step(self):
+        """Envía el siguiente turno; devuelve (latencia en segundos, ok)"""
+        message = self.turns[self.position]
+        body = json.dumps({'message': message}).encode('utf-8')
+        req = urllib.request.Request(f"{self.url}/chat", data=body, method='POST',
+                                     headers={'Content-Type': 'application/json',
+                                              'Accept-Encoding': 'identity'})
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                response.read()
+                ok = response.status == 200
+        except (urllib.error.URLError, http.client.HTTPException, OSError):
+            # HTTPException cubre respuestas cortadas o malformadas (IncompleteRead, RemoteDisconnected)
+            ok = False
+        latency = time.perf_counter() - start
+
+        self.position += 1
+        if self.position >= len(self.turns):
+            self._new_conversation()
+        return latency, ok
+
+class LoadRun:
+    """Ejecución de lazo abierto: se inicia un turno cada 1/rps segundos"""
+    def __init__(self, url, rps, duration, conversations, max_users=200, timeout=30, seed=None):
+        self.url = url.rstrip('/')
+        self.rps = rps
+        self.duration = duration
+        self.conversations = conversations
+        self.max_users = max_users
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.idle_users = queue.Queue()
+        self.users_created = 0
+        self.latencies = []
+        self.errors = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def _acquire_user(self):
+        try:
+            return self.idle_users.get_nowait()
+        except queue.Empty:
+            if self.users_created >= self.max_users:
+                return None
+            self.users_created += 1
+            return VirtualUser(self.url, self.conversations, random.Random(self.rng.random()), self.timeout)
+
+    def _run_turn(self, user):
+        try:
+            latency, ok = user.step()
+            with self.lock:
+                self.latencies.append(latency)
+                if not ok:
+                    self.errors += 1
+        finally:
+            # Un usuario que falla vuelve a la cola; si no, la concurrencia disponible se reduce
+            self.idle_users.put(user)
+
+    def run(self):
+        interval = 1.0 / self.rps
+        start = time.perf_counter()
+        next_tick = start
+        with ThreadPoolExecutor(max_workers=self.max_users) as executor:
+            while next_tick - start < self.duration:
+                user = self._acquire_user()
+                if user is None:
+                    # Todos los usuarios virtuales están ocupados: el sistema no da abasto
+                    self.skipped += 1
+                else:
+                    executor.submit(self._run_turn, user)
+                next_tick += interval
+                time.sleep(max(0.0, next_tick - time.perf_counter()))
+        elapsed = time.perf_counter() - start
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        total = len(self.latencies)
+        return {
+            'target_rps': self.rps,
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 2) if elapsed else 0,
+            'error_rate': round(self.errors / total, 4) if total else 0,
+            'skipped': self.skipped,
+            'users': self.users_created,
+            'latency_ms': {
+                'p50': round(percentile(self.latencies, 0.50) * 1000, 1),
+                'p90': round(percentile(self.latencies, 0.90) * 1000, 1),
+                'p95': round(percentile(self.latencies, 0.95) * 1000, 1),
+                'p99': round(percentile(self.latencies, 0.99) * 1000, 1),
+                'max': round(max(self.latencies) * 1000, 1) if self.latencies else 0
+            }
+        }
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/", timeout=2):
+                return True
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    return False
+
+def run_with_server(serve_cmd, workers, port, args, conversations):
+    """Levanta la app con `workers` workers, ejecuta la carga y la detiene"""
+    command = serve_cmd.format(workers=workers, port=port)
+    # Sin snapshot de sesiones: cada configuración arranca limpia y no hereda métricas de la anterior
+    env = dict(os.environ, SESSION_SNAPSHOT_PATH='')
+    process = subprocess.Popen(shlex.split(command), env=env)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        if not wait_until_ready(url):
+            raise RuntimeError(f"La aplicación no respondió: {command}")
+        return LoadRun(url, args.rps, args.duration, conversations, args.max_users, args.timeout, args.seed).run()
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+def print_report(label, report):
+    latency = report['latency_ms']
+    print(f"[{label}] {report['requests']} req, {report['throughput_rps']} req/s "
+          f"(objetivo {report['target_rps']}), errores {report['error_rate']:.2%}, omitidos {report['skipped']} | "
+          f"p50 {latency['p50']}ms p90 {latency['p90']}ms p95 {latency['p95']}ms p99 {latency['p99']}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description='Generador de carga para /chat')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--rps', type=float, default=10)
+    parser.add_argument('--duration', type=float, default=30, help='segundos')
+    parser.add_argument('--conversations', help='archivo JSONL con conversaciones')
+    parser.add_argument('--max-users', type=int, default=200, help='usuarios virtuales concurrentes')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', help='lista de cantidades de workers, p.ej. 1,2,4 (requiere --serve-cmd)')
+    parser.add_argument('--serve-cmd', help='comando para levantar la app; admite {workers} y {port}')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--output', help='agrega los resultados como JSONL a este archivo')
+    args = parser.parse_args()
+
+    conversations = load_conversations(args.conversations) if args.conversations else DEFAULT_CONVERSATIONS
+    if not conversations:
+        parser.error('No se encontraron conversaciones en el archivo')
+
+    results = []
+    if args.workers:
+        if not args.serve_cmd:
+            parser.error('--workers requiere --serve-cmd')
+        for workers in [int(w) for w in args.workers.split(',')]:
+            report = run_with_server(args.serve_cmd, workers, args.port, args, conversations)
+            report['workers'] = workers
+            print_report(f"workers={workers}", report)
+            results.append(report)
+    else:
+        report = LoadRun(args.url, args.rps, args.duration, conversations, args.max_users, args.timeout, args.seed).run()
+        print_report(args.url, report)
+        results.append(report)
+
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for report in results:
+                f.write(json.dumps(report) + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Servidor local que imita la API ChatCompletion de OpenAI para pruebas de carga.
+
+Uso:
+    python mock_llm.py --port 8001 --latency lognormal --latency-ms 800 --error-rate 0.02
+
+Y apuntar la aplicación a él con:
+    OPENAI_API_BASE=http://localhost:8001/v1 OPENAI_API_KEY=mock python app_new.py
+"""
+from flask import Flask, request, jsonify, Response
+import argparse
+import json
+import math
+import random
+import time
+import uuid
+
+app = Flask(__name__)
+
+config = {
+    'latency': 'fixed',
+    'latency_ms': 300.0,
+    'jitter_ms': 100.0,
+    'token_delay_ms': 20.0,
+    'error_rate': 0.0,
+    'reply': ('Según la política vigente para tripulaciones de JetSmart, este beneficio se gestiona '
+              'con tu jefatura directa y RRHH. Recuerda revisar los plazos y documentar tus solicitudes. '
+              '¿Te puedo ayudar con algo más? ✈️')
+}
+
+def sample_latency():
+    """Latencia en segundos según la distribución configurada"""
+    mean = config['latency_ms']
+    jitter = config['jitter_ms']
+    if config['latency'] == 'uniform':
+        value = random.uniform(max(mean - jitter, 0), mean + jitter)
+    elif config['latency'] == 'normal':
+        value = random.gauss(mean, jitter)
+    elif config['latency'] == 'lognormal':
+        # Parámetros para que la media sea `mean` y la desviación estándar `jitter`
+        sigma = math.sqrt(math.log(1 + (jitter / mean) ** 2)) if mean > 0 else 0
+        mu = math.log(mean) - sigma ** 2 / 2 if mean > 0 else 0
+        value = random.lognormvariate(mu, sigma) if mean > 0 else 0
+    else:
+        value = mean
+    return max(value, 0) / 1000
+
+def count_tokens(text):
+    # Aproximación: ~4 caracteres por token, igual que la regla práctica de OpenAI
+    return max(1, len(text) // 4)
+
+def error_response():
+    if random.random() < 0.5:
+        return jsonify({'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}}), 429
+    return jsonify({'error': {'message': 'The server had an error', 'type': 'server_error'}}), 500
+
+def build_usage(messages, reply):
+    prompt_tokens = sum(count_tokens(m.get('content', '')) for m in messages)
+    completion_tokens = count_tokens(reply)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens
+    }
+
+def stream_completion(completion_id, model, reply):
+    created = int(time.time())
+
+    def chunk(delta, finish_reason=None):
+        payload = {
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': created,
+            'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    def generate():
+        yield chunk({'role': 'assistant'})
+        for word in reply.split(' '):
+            time.sleep(config['token_delay_ms'] / 1000)
+            yield chunk({'content': word + ' '})
+        yield chunk({}, finish_reason='stop')
+        yield "data: [DONE]\n\n"
+
+    return Response(generate(), mimetype='text/event-stream')
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    data = request.get_json(silent=True) or {}
+    messages = data.get('messages', [])
+    model = data.get('model', 'gpt-3.5-turbo')
+
+    time.sleep(sample_latency())
+    if random.random() < config['error_rate']:
+        return error_response()
+
+    reply = config['reply']
+    max_tokens = data.get('max_tokens')
+    if max_tokens:
+        reply = reply[:max_tokens * 4]
+
+    completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+    if data.get('stream'):
+        return stream_completion(completion_id, model, reply)
+
+    return jsonify({
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': reply},
+            'finish_reason': 'stop'
+        }],
+        'usage': build_usage(messages, reply)
+    })
+
+@app.route('/health')
+def health():
+    return jsonify({'status': 'ok', 'config': config})
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor mock de ChatCompletion')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', choices=['fixed', 'uniform', 'normal', 'lognormal'], default=config['latency'])
+    parser.add_argument('--latency-ms', type=float, default=config['latency_ms'])
+    parser.add_argument('--jitter-ms', type=float, default=config['jitter_ms'])
+    parser.add_argument('--token-delay-ms', type=float, default=config['token_delay_ms'])
+    parser.add_argument('--error-rate', type=float, default=config['error_rate'])
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    config.update({
+        'latency': args.latency,
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'token_delay_ms': args.token_delay_ms,
+        'error_rate': args.error_rate
+    })
+    app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""Router con afinidad de sesión para correr varias instancias de la aplicación.
+
+Asigna cada cookie `session_id` a una instancia mediante hashing consistente, de modo
+que las sesiones en memoria del SessionManager sigan funcionando al escalar. Las sesiones
+activas se quedan en su instancia aunque se agreguen otras; solo las nuevas o inactivas
+siguen el anillo (y al cambiar los nodos se reasigna ~1/N de ellas). Al drenar una
+instancia sus sesiones activas siguen llegando a ella hasta que expiran o vence
+--drain-timeout.
+
+Uso:
+    python router.py --port 8000 --backend http://127.0.0.1:5001 --backend http://127.0.0.1:5002
+
+Administración (requiere ADMIN_TOKEN y el header X-Admin-Token; sin token está deshabilitada):
+    GET    /_router/status
+    POST   /_router/nodes   {"url": "http://127.0.0.1:5003"}
+    DELETE /_router/nodes   {"url": "http://127.0.0.1:5001"}   # drena la instancia
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import argparse
+import bisect
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+SESSION_COOKIE = 'session_id'
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                      'te', 'trailers', 'transfer-encoding', 'upgrade', 'host', 'content-length'}
+
+def read_session_cookie(cookie_header):
+    """Primer valor de `session_id` en el header Cookie (el mismo que usa Flask).
+
+    Se parsea a mano porque SimpleCookie falla o se detiene ante cookies ajenas con
+    nombres o valores no estándar (p.ej. `foo@bar=1` o valores JSON).
+    """
+    for part in cookie_header.split(';'):
+        name, separator, value = part.strip().partition('=')
+        if separator and name.strip() == SESSION_COOKIE:
+            return value.strip().strip('"') or None
+    return None
+
+def hash_key(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+class HashRing:
+    """Anillo de hashing consistente con nodos virtuales"""
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.ring = []
+        self.owners = {}
+        self.members = set()
+        for node in nodes:
+            self.add_node(node)
+
+    @property
+    def nodes(self):
+        return sorted(self.members)
+
+    def add_node(self, node):
+        self.members.add(node)
+        for i in range(self.replicas):
+            point = hash_key(f"{node}#{i}")
+            if point not in self.owners:
+                bisect.insort(self.ring, point)
+                self.owners[point] = node
+
+    def remove_node(self, node):
+        self.members.discard(node)
+        points = [point for point, owner in self.owners.items() if owner == node]
+        for point in points:
+            del self.owners[point]
+        removed = set(points)
+        self.ring = [point for point in self.ring if point not in removed]
+
+    def get_node(self, key):
+        if not self.ring:
+            return None
+        index = bisect.bisect(self.ring, hash_key(key)) % len(self.ring)
+        return self.owners[self.ring[index]]
+
+class SessionRouter:
+    """Decide la instancia de cada sesión y gestiona el drenado de instancias"""
+    def __init__(self, backends, session_timeout=3600, drain_timeout=3600, replicas=100):
+        self.ring = HashRing(backends, replicas=replicas)
+        self.session_timeout = session_timeout
+        self.drain_timeout = drain_timeout
+        self.lock = threading.Lock()
+        # Instancias en drenado: url -> momento en que empezó
+        self.draining = {}
+        # Última instancia y actividad de cada sesión: session_id -> (url, last_seen)
+        self.assignments = {}
+        self.last_cleanup = time.monotonic()
+
+    def route(self, session_id):
+        now = time.monotonic()
+        with self.lock:
+            self._cleanup(now)
+            node = None
+            assigned = self.assignments.get(session_id)
+            # Las sesiones activas se quedan en su instancia (aunque esté en drenado o
+            # se hayan agregado otras); solo las nuevas o inactivas siguen el anillo
+            if (assigned and now - assigned[1] < self.session_timeout and
+                    (assigned[0] in self.ring.members or assigned[0] in self.draining)):
+                node = assigned[0]
+            if node is None:
+                node = self.ring.get_node(session_id)
+            if node is not None:
+                self.assignments[session_id] = (node, now)
+            return node
+
+    def add_node(self, node):
+        with self.lock:
+            self.draining.pop(node, None)
+            if node not in self.ring.members:
+                self.ring.add_node(node)
+
+    def drain_node(self, node):
+        with self.lock:
+            if node not in self.ring.members:
+                return False
+            self.ring.remove_node(node)
+            self.draining[node] = time.monotonic()
+            return True
+
+    def _cleanup(self, now):
+        if now - self.last_cleanup < 60:
+            return
+        self.last_cleanup = now
+        self.assignments = {session_id: (node, last_seen) for session_id, (node, last_seen) in self.assignments.items()
+                            if now - last_seen < self.session_timeout}
+        active_nodes = {node for node, _ in self.assignments.values()}
+        for node, started in list(self.draining.items()):
+            if node not in active_nodes or now - started >= self.drain_timeout:
+                logger.info(f"Instancia drenada: {node}")
+                del self.draining[node]
+
+    def status(self):
+        with self.lock:
+            sessions = {}
+            for node, _ in self.assignments.values():
+                sessions[node] = sessions.get(node, 0) + 1
+            return {
+                'nodes': self.ring.nodes,
+                'draining': {node: round(time.monotonic() - started) for node, started in self.draining.items()},
+                'sessions': sessions
+            }
+
+class RouterHandler(BaseHTTPRequestHandler):
+    router = None
+    timeout_seconds = 60
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def _handle(self):
+        if self.path.startswith('/_router/'):
+            return self._handle_admin()
+
+        session_id = read_session_cookie(self.headers.get('Cookie', ''))
+        new_session = session_id is None
+        if new_session:
+            # Se crea la sesión aquí para poder enrutarla desde la primera petición
+            session_id = os.urandom(16).hex()
+
+        node = self.router.route(session_id)
+        if node is None:
+            return self._send_json(503, {'error': 'No hay instancias disponibles'})
+        self._proxy(node, session_id, new_session)
+
+    def _proxy(self, node, session_id, new_session):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        body = self.rfile.read(length) if length else None
+
+        headers = {key: value for key, value in self.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS}
+        if new_session:
+            cookie_header = headers.get('Cookie')
+            headers['Cookie'] = f"{cookie_header}; {SESSION_COOKIE}={session_id}" if cookie_header else f"{SESSION_COOKIE}={session_id}"
+        headers['X-Forwarded-For'] = self.client_address[0]
+
+        target = urlsplit(node)
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=self.timeout_seconds)
+        try:
+            connection.request(self.command, self.path, body=body, headers=headers)
+            upstream = connection.getresponse()
+            payload = upstream.read()
+        except OSError as e:
+            logger.error(f"Error al reenviar a {node}: {e}")
+            return self._send_json(502, {'error': 'Instancia no disponible'})
+        finally:
+            connection.close()
+
+        self.send_response(upstream.status)
+        for key, value in upstream.getheaders():
+            if key.lower() not in HOP_BY_HOP_HEADERS:
+                self.send_header(key, value)
+        if new_session:
+            self.send_header('Set-Cookie', f"{SESSION_COOKIE}={session_id}; Max-Age={self.router.session_timeout}; HttpOnly; Path=/; SameSite=Lax")
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle_admin(self):
+        token = self.headers.get('X-Admin-Token', '')
+        if not ADMIN_TOKEN or not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return self._send_json(403, {'error': 'No autorizado'})
+
+        if self.path == '/_router/status' and self.command == 'GET':
+            return self._send_json(200, self.router.status())
+
+        if self.path == '/_router/nodes' and self.command in ('POST', 'DELETE'):
+            length = int(self.headers.get('Content-Length', 0) or 0)
+            try:
+                node = json.loads(self.rfile.read(length) or b'{}').get('url')
+            except ValueError:
+                node = None
+            if not node:
+                return self._send_json(400, {'error': 'Falta la url de la instancia'})
+            if self.command == 'POST':
+                self.router.add_node(node.rstrip('/'))
+            elif not self.router.drain_node(node.rstrip('/')):
+                return self._send_json(404, {'error': 'Instancia desconocida'})
+            return self._send_json(200, self.router.status())
+
+        self._send_json(404, {'error': 'No encontrado'})
+
+    def _send_json(self, status, data):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def main():
+    parser = argparse.ArgumentParser(description='Router con afinidad de sesión para CrewSMART')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '8000')))
+    parser.add_argument('--backend', action='append', default=[], help='url de una instancia (repetible)')
+    parser.add_argument('--replicas', type=int, default=100, help='nodos virtuales por instancia')
+    parser.add_argument('--session-timeout', type=int, default=3600)
+    parser.add_argument('--drain-timeout', type=int, default=3600)
+    parser.add_argument('--timeout', type=float, default=60, help='timeout hacia las instancias')
+    args = parser.parse_args()
+
+    RouterHandler.router = SessionRouter([b.rstrip('/') for b in args.backend], args.session_timeout,
+                                         args.drain_timeout, args.replicas)
+    RouterHandler.timeout_seconds = args.timeout
+    server = ThreadingHTTPServer((args.host, args.port), RouterHandler)
+    logger.info(f"Router escuchando en {args.host}:{args.port} con {len(args.backend)} instancias")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()